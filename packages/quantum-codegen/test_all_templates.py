@@ -6,13 +6,25 @@ Tests all quantum code generation templates
 Run with: python test_all_templates.py
 """
 
-import subprocess
+import asyncio
 import sys
 import os
-from pathlib import Path
+import io
+import re
+import ast
+import importlib.machinery
+import importlib.util
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 import json
 from datetime import datetime
 
+try:
+    import orjson  # Optional: much faster results serialization
+except ImportError:
+    orjson = None
+
 # ============================================================================
 # TEST CONFIGURATION
 # ============================================================================
@@ -43,6 +55,27 @@ TEMPLATES = {
 # Test modes
 QUICK_TEST = True  # Set to False for full tests (takes longer)
 
+# Per-template timeout for full execution tests (seconds)
+EXECUTION_TIMEOUT = 600
+
+# Templates dispatched to each worker at a time
+POOL_CHUNKSIZE = 2
+
+# Syntax check results and imported modules keyed by template mtime/size,
+# reused across runs of the same interpreter version
+TEMPLATE_CACHE_FILE = '.template_test_cache.json'
+
+# Every needle the quality check looks for, matched in a single pass over
+# the raw template bytes (all needles are ASCII, so no decode is needed)
+# (only 'placeholder' is matched case-insensitively)
+QUALITY_PATTERN = re.compile(
+    rb'TODO|FIXME|(?i:placeholder)|qiskit\.aqua|qiskit\.chemistry|PhysicsValidator'
+    rb'|\btry:|\bexcept\b'
+)
+PLACEHOLDER_MARKERS = frozenset({b'TODO', b'FIXME', b'placeholder'})
+OLD_API_MARKERS = frozenset({b'qiskit.aqua', b'qiskit.chemistry'})
+ERROR_HANDLING_MARKERS = frozenset({b'try:', b'except'})
+
 # ============================================================================
 # TEST UTILITIES
 # ============================================================================
@@ -56,232 +89,374 @@ class Colors:
     RESET = '\033[0m'
     BOLD = '\033[1m'
 
-def print_header(text):
+# Message formats, built once instead of on every call
+HEADER_FORMAT = f"\n{Colors.BOLD}{Colors.BLUE}{'='*70}\n{{}}\n{'='*70}{Colors.RESET}\n"
+SUCCESS_FORMAT = f"{Colors.GREEN}✅ {{}}{Colors.RESET}"
+ERROR_FORMAT = f"{Colors.RED}❌ {{}}{Colors.RESET}"
+WARNING_FORMAT = f"{Colors.YELLOW}⚠️  {{}}{Colors.RESET}"
+INFO_FORMAT = f"{Colors.BLUE}ℹ️  {{}}{Colors.RESET}"
+
+def print_header(text, file=None):
     """Print formatted header"""
-    print(f"\n{Colors.BOLD}{Colors.BLUE}{'='*70}")
-    print(f"{text.center(70)}")
-    print(f"{'='*70}{Colors.RESET}\n")
+    print(HEADER_FORMAT.format(text.center(70)), file=file)
 
-def print_success(text):
+def print_success(text, file=None):
     """Print success message"""
-    print(f"{Colors.GREEN}✅ {text}{Colors.RESET}")
+    print(SUCCESS_FORMAT.format(text), file=file)
 
-def print_error(text):
+def print_error(text, file=None):
     """Print error message"""
-    print(f"{Colors.RED}❌ {text}{Colors.RESET}")
+    print(ERROR_FORMAT.format(text), file=file)
 
-def print_warning(text):
+def print_warning(text, file=None):
     """Print warning message"""
-    print(f"{Colors.YELLOW}⚠️  {text}{Colors.RESET}")
+    print(WARNING_FORMAT.format(text), file=file)
 
-def print_info(text):
+def print_info(text, file=None):
     """Print info message"""
-    print(f"{Colors.BLUE}ℹ️  {text}{Colors.RESET}")
+    print(INFO_FORMAT.format(text), file=file)
 
 # ============================================================================
 # TEMPLATE TESTS
 # ============================================================================
 
+@dataclass
+class TemplateCtx:
+    """A template file read once and shared by every check"""
+    path: str
+    parent: str
+    content_bytes: bytes
+    mtime_ns: int
+    size: int
+
+def load_template(template_path):
+    """Read a template and its stat info in a single open"""
+    with open(template_path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        content_bytes = f.read()
+    return TemplateCtx(
+        path=template_path,
+        parent=os.path.dirname(template_path),
+        content_bytes=content_bytes,
+        mtime_ns=st.st_mtime_ns,
+        size=st.st_size
+    )
+
 def check_template_exists(template_path):
     """Check if template file exists"""
-    return Path(template_path).exists()
+    return os.path.exists(template_path)
 
-def check_template_quality(template_path):
+def check_template_quality(ctx):
     """Check template quality metrics"""
-    with open(template_path, 'r') as f:
-        content = f.read()
+    content = ctx.content_bytes
+    
+    # A docstring only counts within the first 500 characters, read the way
+    # text mode would: universal newlines, so CRLF is a single character.
+    # 500 characters never span more than 2000 bytes.
+    head = content[:2000].replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    has_docstring = '"""' in head.decode('utf-8', 'surrogateescape')[:500]
+    
+    # Scan the file once and collect which needles appear
+    matches = set()
+    for match in QUALITY_PATTERN.finditer(content):
+        token = match.group(0)
+        # Fold 'Placeholder', 'PLACEHOLDER', ... into one marker
+        if token.lower() == b'placeholder':
+            token = b'placeholder'
+        matches.add(token)
     
     issues = []
     
     # Check for placeholders
-    if 'TODO' in content or 'FIXME' in content or 'placeholder' in content.lower():
+    if matches & PLACEHOLDER_MARKERS:
         issues.append("Contains placeholders (TODO/FIXME)")
     
     # Check for old API
-    if 'qiskit.aqua' in content or 'qiskit.chemistry' in content:
+    if matches & OLD_API_MARKERS:
         issues.append("Uses old Qiskit API")
     
     # Check for physics validation
-    if 'PhysicsValidator' not in content:
+    if b'PhysicsValidator' not in matches:
         issues.append("Missing PhysicsValidator class")
     
     # Check line count
-    lines = content.split('\n')
-    if len(lines) < 300:
-        issues.append(f"Too short ({len(lines)} lines, should be 400+)")
+    line_count = content.count(b'\n') + 1
+    if line_count < 300:
+        issues.append(f"Too short ({line_count} lines, should be 400+)")
     
     # Check for documentation
-    if '"""' not in content[:500]:
+    if not has_docstring:
         issues.append("Missing docstring")
     
     # Check for error handling
-    if 'try:' not in content or 'except' not in content:
+    if not ERROR_HANDLING_MARKERS <= matches:
         issues.append("Missing error handling")
     
     return issues
 
-def run_template_syntax_check(template_path):
-    """Check Python syntax"""
+# Cached template analysis loaded from TEMPLATE_CACHE_FILE, and new entries
+# recorded by this process that still need to be written back
+_template_cache = {}
+_template_cache_updates = {}
+
+def load_template_cache():
+    """Load cached template analysis results"""
     try:
-        result = subprocess.run(
-            [sys.executable, '-m', 'py_compile', template_path],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        return result.returncode == 0, result.stderr
-    except Exception as e:
-        return False, str(e)
+        with open(TEMPLATE_CACHE_FILE, 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    
+    # What compiles depends on the interpreter, so results recorded by a
+    # different Python version are discarded
+    if not isinstance(data, dict) or data.get('cache_tag') != sys.implementation.cache_tag:
+        return {}
+    return data.get('templates', {})
 
-def run_template_import_check(template_path):
-    """Check if all imports work"""
+def save_template_cache(cache):
+    """Save template analysis results for the next run"""
+    data = {'cache_tag': sys.implementation.cache_tag, 'templates': cache}
     try:
-        # Create a test script that imports the template
-        test_code = f"""
-import sys
-sys.path.insert(0, '{Path(template_path).parent}')
-try:
-    with open('{template_path}', 'r') as f:
-        code = f.read()
-    # Extract imports
-    import_lines = [line for line in code.split('\\n') if line.strip().startswith('import') or line.strip().startswith('from')]
-    for line in import_lines:
-        if 'import' in line and not line.strip().startswith('#'):
-            try:
-                exec(line)
-            except ImportError as e:
-                print(f"IMPORT_ERROR: {{e}}")
-    print("IMPORTS_OK")
-except Exception as e:
-    print(f"ERROR: {{e}}")
-"""
-        result = subprocess.run(
-            [sys.executable, '-c', test_code],
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
-        
-        if 'IMPORTS_OK' in result.stdout:
-            return True, None
-        elif 'IMPORT_ERROR' in result.stdout:
-            return False, result.stdout
-        else:
-            return False, result.stderr
+        with open(TEMPLATE_CACHE_FILE, 'w') as f:
+            json.dump(data, f)
+    except OSError as e:
+        print_warning(f"Could not save template cache: {e}")
+
+def extract_imports(tree):
+    """Collect top-level module names imported by a parsed template"""
+    mods = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            mods.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            mods.add(node.module.split('.')[0])
+    return mods
+
+def analyze_template(ctx):
+    """Parse and compile a template once, reusing cached results if unchanged"""
+    for cache in (_template_cache_updates, _template_cache):
+        entry = cache.get(ctx.path)
+        if (entry and entry['mtime_ns'] == ctx.mtime_ns and entry['size'] == ctx.size
+                and 'imports' in entry):
+            return entry
+    
+    tree = None
+    try:
+        # Parsing and compiling can emit SyntaxWarnings, which would go
+        # straight to stderr outside this template's report
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            # ast.parse() decodes the bytes itself, honouring any coding cookie
+            tree = ast.parse(ctx.content_bytes, ctx.path)
+            compile(tree, ctx.path, 'exec')
+        ok, error = True, None
+    except SyntaxError as e:
+        # Null bytes are rejected before parsing, without a location
+        location = f"{ctx.path}:{e.lineno}" if e.lineno else ctx.path
+        ok, error = False, f"{location}: {e.msg}"
+    except ValueError as e:
+        # Raised instead of SyntaxError for null bytes on older Pythons
+        ok, error = False, f"{ctx.path}: {e}"
+    
+    entry = {
+        'mtime_ns': ctx.mtime_ns, 'size': ctx.size, 'ok': ok, 'error': error,
+        # Imported modules depend only on the source; whether they are
+        # installed is checked again on every run
+        'imports': sorted(extract_imports(tree)) if tree is not None else None
+    }
+    _template_cache_updates[ctx.path] = entry
+    return entry
+
+def run_template_syntax_check(ctx):
+    """Check Python syntax"""
+    entry = analyze_template(ctx)
+    return entry['ok'], entry['error']
+
+def module_available(module, template_dir):
+    """Check a module is installed or sits next to the template"""
+    return (importlib.util.find_spec(module) is not None
+            or importlib.machinery.PathFinder.find_spec(module, [template_dir]) is not None)
+
+def run_template_import_check(ctx):
+    """Check if all imports are available (None if the file can't be parsed)"""
+    imports = analyze_template(ctx)['imports']
+    if imports is None:
+        # Already reported by the syntax check; imports can't be determined
+        return None, "Unparseable template (see syntax check)"
+    
+    try:
+        missing = [m for m in imports if not module_available(m, ctx.parent)]
+        if missing:
+            return False, f"Missing modules: {', '.join(missing)}"
+        return True, None
             
     except Exception as e:
         return False, str(e)
 
-def run_template_execution(template_path):
-    """Run template (quick mode or full)"""
-    if QUICK_TEST:
-        # Just check if it starts without errors
-        print_info(f"Quick test mode - checking startup only")
-        return True, "Skipped (quick mode)"
-    
-    try:
-        print_info(f"Running full execution test (may take several minutes)...")
-        result = subprocess.run(
-            [sys.executable, template_path],
-            capture_output=True,
-            text=True,
-            timeout=600  # 10 minute timeout
-        )
+async def run_template_execution(template_path, semaphore):
+    """Run template to completion in a subprocess (full mode only)"""
+    async with semaphore:
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable, template_path,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+        except Exception as e:
+            return False, str(e)
         
-        success = result.returncode == 0
-        output = result.stdout if success else result.stderr
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                proc.communicate(), timeout=EXECUTION_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            return False, f"Execution timeout (>{EXECUTION_TIMEOUT}s)"
+        except Exception as e:
+            # Keep one failing template from aborting the others
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            return False, str(e)
         
-        return success, output
+        success = proc.returncode == 0
+        output = stdout if success else stderr
         
-    except subprocess.TimeoutExpired:
-        return False, "Execution timeout (>10 minutes)"
-    except Exception as e:
-        return False, str(e)
+        return success, output.decode(errors='replace')
+
+async def run_all_executions(template_paths):
+    """Run execution tests concurrently, at most one per CPU at a time"""
+    semaphore = asyncio.Semaphore(os.cpu_count() or 1)
+    return await asyncio.gather(
+        *(run_template_execution(path, semaphore) for path in template_paths)
+    )
 
 # ============================================================================
 # TEST RUNNER
 # ============================================================================
 
-def test_template(template_path):
-    """Run all tests on a single template"""
-    template_name = Path(template_path).name
-    print(f"\n{Colors.BOLD}Testing: {template_name}{Colors.RESET}")
-    print("-" * 70)
+def test_template(template_path, out=None):
+    """Run all tests on a single template, writing its report in one go"""
+    buf = io.StringIO()
+    template_name = os.path.basename(template_path)
+    print(f"\n{Colors.BOLD}Testing: {template_name}{Colors.RESET}", file=buf)
+    print("-" * 70, file=buf)
+    
+    # Test 1: File exists (nothing else can run without it)
+    print("1. Checking file exists...", end=" ", file=buf)
+    if not check_template_exists(template_path):
+        print_error("FAIL - File not found", file=buf)
+        write_report(buf, out)
+        return {
+            'template': template_name,
+            'path': template_path,
+            'tests': {'exists': False},
+            'passed': False,
+            'score': '0/1'
+        }
+    print_success("PASS", file=buf)
     
     results = {
         'template': template_name,
         'path': template_path,
-        'tests': {}
+        'tests': {'exists': True}
     }
     
-    # Test 1: File exists
-    print("1. Checking file exists...", end=" ")
-    if check_template_exists(template_path):
-        print_success("PASS")
-        results['tests']['exists'] = True
-    else:
-        print_error("FAIL - File not found")
-        results['tests']['exists'] = False
-        return results
+    ctx = load_template(template_path)
     
     # Test 2: Quality checks
-    print("2. Checking template quality...", end=" ")
-    issues = check_template_quality(template_path)
+    print("2. Checking template quality...", end=" ", file=buf)
+    issues = check_template_quality(ctx)
     if not issues:
-        print_success("PASS")
+        print_success("PASS", file=buf)
         results['tests']['quality'] = True
     else:
-        print_error(f"FAIL - {len(issues)} issues")
+        print_error(f"FAIL - {len(issues)} issues", file=buf)
         for issue in issues:
-            print(f"   - {issue}")
+            print(f"   - {issue}", file=buf)
         results['tests']['quality'] = False
     
     # Test 3: Syntax check
-    print("3. Checking Python syntax...", end=" ")
-    syntax_ok, error = run_template_syntax_check(template_path)
+    print("3. Checking Python syntax...", end=" ", file=buf)
+    syntax_ok, error = run_template_syntax_check(ctx)
     if syntax_ok:
-        print_success("PASS")
+        print_success("PASS", file=buf)
         results['tests']['syntax'] = True
     else:
-        print_error("FAIL")
-        print(f"   {error}")
+        print_error("FAIL", file=buf)
+        print(f"   {error}", file=buf)
         results['tests']['syntax'] = False
     
     # Test 4: Import check
-    print("4. Checking imports...", end=" ")
-    imports_ok, error = run_template_import_check(template_path)
+    print("4. Checking imports...", end=" ", file=buf)
+    imports_ok, error = run_template_import_check(ctx)
     if imports_ok:
-        print_success("PASS")
+        print_success("PASS", file=buf)
         results['tests']['imports'] = True
+    elif imports_ok is None:
+        print_info(f"SKIPPED - {error}", file=buf)
+        results['tests']['imports'] = None
     else:
-        print_warning("FAIL - Missing dependencies")
+        print_warning("FAIL - Missing dependencies", file=buf)
         if error:
-            print(f"   {error[:200]}")
+            print(f"   {error[:200]}", file=buf)
         results['tests']['imports'] = False
     
     # Test 5: Execution (optional in quick mode)
+    # Full runs are started together by run_all_tests once every template
+    # has been checked, so they can run concurrently
+    print("5. Execution test: ", end="", file=buf)
     if not QUICK_TEST:
-        print("5. Running execution test...", end=" ")
-        exec_ok, output = run_template_execution(template_path)
-        if exec_ok:
-            print_success("PASS")
-            results['tests']['execution'] = True
-        else:
-            print_error("FAIL")
-            print(f"   {output[:200]}")
-            results['tests']['execution'] = False
+        print_info("QUEUED (runs after all static checks)", file=buf)
     else:
-        print("5. Execution test: ", end="")
-        print_info("SKIPPED (quick mode)")
-        results['tests']['execution'] = None
+        print_info("SKIPPED (quick mode)", file=buf)
+    results['tests']['execution'] = None
     
-    # Calculate score
+    score_template(results)
+    write_report(buf, out)
+    return results
+
+def write_report(buf, out=None):
+    """Write a buffered template report with a single write"""
+    out = out if out is not None else sys.stdout
+    out.write(buf.getvalue())
+    out.flush()
+
+def score_template(results):
+    """Calculate score from the tests that ran"""
     passed = sum(1 for v in results['tests'].values() if v is True)
     total = sum(1 for v in results['tests'].values() if v is not None)
     results['score'] = f"{passed}/{total}"
     results['passed'] = passed == total
+
+def _init_worker(template_cache):
+    """Executor worker initializer: share the loaded template cache"""
+    global _template_cache
+    _template_cache = template_cache
+
+def _test_template_task(task):
+    """Executor worker: test one template, capturing its report output"""
+    category, template_path = task
+    buf = io.StringIO()
+    result = test_template(template_path, out=buf)
     
-    return results
+    # Hand new analysis results back to the parent, which owns the cache file
+    updates = dict(_template_cache_updates)
+    _template_cache_updates.clear()
+    return category, template_path, result, buf.getvalue(), updates
+
+def save_results(all_results, results_file):
+    """Atomically write the results collected so far"""
+    if orjson is not None:
+        data = orjson.dumps(all_results, option=orjson.OPT_INDENT_2)
+    else:
+        data = json.dumps(all_results, indent=2).encode()
+    
+    tmp_file = f"{results_file}.tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_file, results_file)
 
 def run_all_tests():
     """Run tests on all templates"""
@@ -290,18 +465,75 @@ def run_all_tests():
     print_info(f"Test mode: {'QUICK' if QUICK_TEST else 'FULL'}")
     print_info(f"Python: {sys.version.split()[0]}")
     print_info(f"Working directory: {os.getcwd()}")
+    print_info(f"Workers: {os.cpu_count()}")
+    
+    # Templates are independent, so fan them out across one process pool
+    # that stays alive for the whole run; its workers compile and check
+    # imports in-process instead of starting a fresh interpreter per check
+    tasks = [
+        (category, template)
+        for category, templates in TEMPLATES.items()
+        for template in templates
+    ]
+    all_results = {category: [] for category in TEMPLATES}
+    remaining = {category: len(templates) for category, templates in TEMPLATES.items()}
+    
+    # Results are saved after every finished category, so an interrupted
+    # run still leaves the completed categories on disk
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    results_file = f"test_results_{timestamp}.json"
+    
+    template_cache = load_template_cache()
+    template_cache_dirty = False
+    
+    with ProcessPoolExecutor(
+        max_workers=os.cpu_count(),
+        initializer=_init_worker,
+        initargs=(template_cache,)
+    ) as executor:
+        for category, template, result, output, updates in executor.map(
+            _test_template_task, tasks, chunksize=POOL_CHUNKSIZE
+        ):
+            # Results arrive in task order, so a category starts at its first result
+            if not all_results[category]:
+                print_header(f"{category} TEMPLATES")
+            # Each template's report is written in one go to avoid interleaving
+            sys.stdout.write(output)
+            sys.stdout.flush()
+            all_results[category].append(result)
+            remaining[category] -= 1
+            if not remaining[category]:
+                save_results(all_results, results_file)
+            if updates:
+                template_cache.update(updates)
+                template_cache_dirty = True
     
-    all_results = {}
+    if template_cache_dirty:
+        save_template_cache(template_cache)
     
-    for category, templates in TEMPLATES.items():
-        print_header(f"{category} TEMPLATES")
+    # Full mode: execute every template that exists, all at once
+    if not QUICK_TEST:
+        print_header("EXECUTION TESTS")
+        to_run = [
+            result
+            for results in all_results.values()
+            for result in results
+            if result['tests']['exists']
+        ]
+        print_info(f"Running {len(to_run)} templates (may take several minutes)...")
+        executions = asyncio.run(run_all_executions([r['path'] for r in to_run]))
         
-        category_results = []
-        for template in templates:
-            result = test_template(template)
-            category_results.append(result)
+        for result, (exec_ok, output) in zip(to_run, executions):
+            print(f"{result['template']}: ", end="")
+            if exec_ok:
+                print_success("PASS")
+            else:
+                print_error("FAIL")
+                print(f"   {output[:200]}")
+            result['tests']['execution'] = exec_ok
+            score_template(result)
         
-        all_results[category] = category_results
+        save_results(all_results, results_file)
     
     # Print summary
     print_header("TEST SUMMARY")
@@ -326,11 +558,7 @@ def run_all_tests():
     print(f"  Failed: {total_templates - total_passed}")
     print(f"  Success rate: {(total_passed/total_templates)*100:.1f}%")
     
-    # Save results
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    results_file = f"test_results_{timestamp}.json"
-    with open(results_file, 'w') as f:
-        json.dump(all_results, f, indent=2)
+    # Results were saved as each category finished
     print(f"\n{Colors.BLUE}Results saved to: {results_file}{Colors.RESET}")
     
     # Final verdict